@@ -1,54 +1,108 @@
 #%% 
+import hashlib
+import logging
+import os
 import time
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from operator import itemgetter
 from typing import Optional, Dict, Any, List
 
-from requests import Request, Session, Response
+from requests import PreparedRequest, Request, Session, Response
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import hmac
+
+try:
+    from orjson import loads as _json_loads
+except ImportError:
+    from json import loads as _json_loads
+
+try:
+    import diskcache
+except ImportError:
+    diskcache = None
 # from ciso8601 import parse_datetime
 
+_log = logging.getLogger(__name__)
+
 
 class FtxClient:
     _ENDPOINT = 'https://ftx.com/api/'
+    # endpoints whose results never change once their end_time has passed
+    _CACHEABLE_ENDPOINTS = ('candles', 'funding_rates')
 
-    def __init__(self, api_key=None, api_secret=None, subaccount_name=None) -> None:
+    def __init__(self, api_key=None, api_secret=None, subaccount_name=None, cache_dir=None) -> None:
         self._session = Session()
+        # only idempotent methods are retried, a retried POST could place an order twice
+        retry = Retry(total=5, backoff_factor=0.2, status_forcelist=(429, 500, 502, 503, 504),
+                      allowed_methods=frozenset(['GET', 'DELETE']), raise_on_status=False)
+        self._session.mount('https://', HTTPAdapter(pool_connections=32, pool_maxsize=32, max_retries=retry))
+        self._session.headers.update({'FTX-KEY': api_key, 'Connection': 'keep-alive'})
         self._api_key = api_key
         self._api_secret = api_secret
         self._subaccount_name = subaccount_name
+        self._api_secret_bytes = (api_secret or '').encode()
+        self._subaccount_header = urllib.parse.quote(subaccount_name) if subaccount_name else None
+        # opt-in on-disk cache for historical GETs, e.g. cache_dir='~/.ftx_cache'
+        if cache_dir is not None:
+            if diskcache is None:
+                raise ImportError('cache_dir requires the diskcache package')
+            self._cache = diskcache.Cache(os.path.expanduser(cache_dir))
+        else:
+            self._cache = None
+        self._positions_cache = (0.0, False, {})
 
     def _get(self, path: str, params: Optional[Dict[str, Any]] = None) -> Any:
-        return self._request('GET', path, params=params)
+        if params:
+            params = {k: v for k, v in params.items() if v is not None}
+        if self._cache is None or not self._is_cacheable(path, params):
+            return self._request('GET', path, params=params)
+        query = urllib.parse.urlencode(sorted(params.items()))
+        key = hashlib.blake2b(f'{path.lstrip("/")}?{query}'.encode(), digest_size=16).digest()
+        result = self._cache.get(key)
+        if result is None:
+            result = self._request('GET', path, params=params)
+            self._cache.set(key, result)
+        return result
+
+    def _is_cacheable(self, path: str, params: Optional[Dict[str, Any]]) -> bool:
+        if path.rstrip('/').rsplit('/', 1)[-1] not in self._CACHEABLE_ENDPOINTS:
+            return False
+        # only a unix end_time in the past marks a closed window
+        end_time = (params or {}).get('end_time')
+        return isinstance(end_time, (int, float)) and end_time < time.time() - 60
 
     def _post(self, path: str, params: Optional[Dict[str, Any]] = None) -> Any:
+        self._positions_cache = (0.0, False, {})
         return self._request('POST', path, json=params)
 
     def _delete(self, path: str, params: Optional[Dict[str, Any]] = None) -> Any:
+        self._positions_cache = (0.0, False, {})
         return self._request('DELETE', path, json=params)
 
     def _request(self, method: str, path: str, **kwargs) -> Any:
-        request = Request(method, self._ENDPOINT + path, **kwargs)
-        self._sign_request(request)
-        response = self._session.send(request.prepare())
+        prepared = self._session.prepare_request(Request(method, self._ENDPOINT + path, **kwargs))
+        self._sign_request(prepared)
+        response = self._session.send(prepared)
         return self._process_response(response)
 
-    def _sign_request(self, request: Request) -> None:
+    def _sign_request(self, prepared: PreparedRequest) -> None:
+        # FTX-KEY is already merged in from the session headers by prepare_request
         ts = int(time.time() * 1000)
-        prepared = request.prepare()
-        signature_payload = f'{ts}{prepared.method}{prepared.path_url}'.encode()
-        if prepared.body:
-            signature_payload += prepared.body
-        signature = hmac.new(self._api_secret.encode(), signature_payload, 'sha256').hexdigest()
-        request.headers['FTX-KEY'] = self._api_key
-        request.headers['FTX-SIGN'] = signature
-        request.headers['FTX-TS'] = str(ts)
-        if self._subaccount_name:
-            request.headers['FTX-SUBACCOUNT'] = urllib.parse.quote(self._subaccount_name)
+        signature_payload = b'%d%b%b%b' % (ts, prepared.method.encode(), prepared.path_url.encode(),
+                                           prepared.body or b'')
+        signature = hmac.digest(self._api_secret_bytes, signature_payload, 'sha256').hex()
+        prepared.headers['FTX-SIGN'] = signature
+        prepared.headers['FTX-TS'] = str(ts)
+        if self._subaccount_header:
+            prepared.headers['FTX-SUBACCOUNT'] = self._subaccount_header
 
     def _process_response(self, response: Response) -> Any:
         try:
-            data = response.json()
-        except ValueError:
+            data = _json_loads(response.content)
+        except ValueError:  # orjson.JSONDecodeError subclasses ValueError too
             response.raise_for_status()
             raise
         else:
@@ -72,19 +126,19 @@ class FtxClient:
         return self._get(f'markets/{market}/trades')
 
     def get_account_info(self) -> dict:
-        return self._get(f'account')
+        return self._get('account')
 
     def get_open_orders(self, market: str = None) -> List[dict]:
-        return self._get(f'orders', {'market': market})
+        return self._get('orders', {'market': market})
     
     def get_historical_price(self, market: str = None, resolution: float = None, start_time: float = None, end_time: float = None) -> List[dict]:
         return self._get(f'markets/{market}/candles', {'resolution': resolution, 'start_time': start_time, 'end_time': end_time})
 
     def get_order_history(self, market: str = None, side: str = None, order_type: str = None, start_time: float = None, end_time: float = None) -> List[dict]:
-        return self._get(f'orders/history', {'market': market, 'side': side, 'orderType': order_type, 'start_time': start_time, 'end_time': end_time})
+        return self._get('orders/history', {'market': market, 'side': side, 'orderType': order_type, 'start_time': start_time, 'end_time': end_time})
         
     def get_conditional_order_history(self, market: str = None, side: str = None, type: str = None, order_type: str = None, start_time: float = None, end_time: float = None) -> List[dict]:
-        return self._get(f'conditional_orders/history', {'market': market, 'side': side, 'type': type, 'orderType': order_type, 'start_time': start_time, 'end_time': end_time})
+        return self._get('conditional_orders/history', {'market': market, 'side': side, 'type': type, 'orderType': order_type, 'start_time': start_time, 'end_time': end_time})
 
     def modify_order(
         self, existing_order_id: Optional[str] = None,
@@ -103,7 +157,7 @@ class FtxClient:
         })
 
     def get_conditional_orders(self, market: str = None) -> List[dict]:
-        return self._get(f'conditional_orders', {'market': market})
+        return self._get('conditional_orders', {'market': market})
 
     def place_order(self, market: str, side: str, price: float, size: float, type: str = 'limit',
                     reduce_only: bool = False, ioc: bool = False, post_only: bool = False,
@@ -146,13 +200,13 @@ class FtxClient:
 
     def cancel_orders(self, market_name: str = None, conditional_orders: bool = False,
                       limit_orders: bool = False) -> dict:
-        return self._delete(f'orders', {'market': market_name,
+        return self._delete('orders', {'market': market_name,
                                         'conditionalOrdersOnly': conditional_orders,
                                         'limitOrdersOnly': limit_orders,
                                         })
 
     def get_fills(self) -> List[dict]:
-        return self._get(f'fills')
+        return self._get('fills')
 
     def get_balances(self) -> List[dict]:
         return self._get('wallet/balances')
@@ -163,11 +217,18 @@ class FtxClient:
     def get_positions(self, show_avg_price: bool = False) -> List[dict]:
         return self._get('positions', {'showAvgPrice': show_avg_price})
 
-    def get_position(self, name: str, show_avg_price: bool = False) -> dict:
-        return next(filter(lambda x: x['future'] == name, self.get_positions(show_avg_price)), None)
+    def get_position(self, name: str, show_avg_price: bool = False, max_age: float = 1.0) -> dict:
+        # positions by future, reused for max_age seconds; any POST/DELETE drops them
+        fetched_at, cached_avg_price, positions = self._positions_cache
+        now = time.time()
+        if max_age <= 0 or now - fetched_at > max_age or cached_avg_price != show_avg_price:
+            positions = {p['future']: p for p in self.get_positions(show_avg_price)}
+            self._positions_cache = (now, show_avg_price, positions)
+        return positions.get(name)
 
     def get_all_trades(self, market: str, start_time: float = None, end_time: float = None, order= None) -> List:
         ids = set()
+        seen_add = ids.add
         limit = 100
         results = []
         while True:
@@ -176,15 +237,49 @@ class FtxClient:
                 'start_time': start_time,
                 'order': order
             })
-            deduped_trades = [r for r in response if r['id'] not in ids]
+            deduped_trades = []
+            min_time = None
+            for r in response:
+                trade_id = r['id']
+                if trade_id not in ids:
+                    seen_add(trade_id)
+                    deduped_trades.append(r)
+                t = r['time']
+                if min_time is None or t < min_time:
+                    min_time = t
             results.extend(deduped_trades)
-            ids |= {r['id'] for r in deduped_trades}
-            print(f'Adding {len(response)} trades with end time {end_time}')
+            _log.debug('Adding %d trades with end time %s', len(response), end_time)
             if len(response) == 0:
                 break
-            end_time = min(t['time'] for t in response)
+            # trade times are ISO strings, the endpoint wants unix seconds
+            end_time = datetime.fromisoformat(min_time).timestamp()
             if len(response) < limit:
                 break
         return results
 
-
+    def get_all_trades_parallel(self, market: str, start_time: float, end_time: float,
+                                windows: int = 8, max_workers: int = 4, order=None) -> List:
+        """
+        Split [start_time, end_time] into `windows` slices and page through them concurrently.
+        Trades come back newest first, or oldest first with order='asc'.
+        Keep max_workers low enough to stay under the exchange's rate limit.
+        """
+        assert windows >= 1, 'Need at least one window'
+        step = (end_time - start_time) / windows
+        bounds = [(start_time + i * step, start_time + (i + 1) * step) for i in reversed(range(windows))]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pages = executor.map(lambda b: self.get_all_trades(market, b[0], b[1], order), bounds)
+            # trades sitting exactly on a window boundary come back twice
+            ids = set()
+            seen_add = ids.add
+            results = []
+            for page in pages:
+                for r in page:
+                    trade_id = r['id']
+                    if trade_id not in ids:
+                        seen_add(trade_id)
+                        results.append(r)
+        if order == 'asc':
+            # slices are merged newest first, ISO times with the same offset sort lexically
+            results.sort(key=itemgetter('time'))
+        return results
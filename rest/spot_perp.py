@@ -1,271 +1,118 @@
 #%% 
-import time
-import urllib.parse
-from typing import Optional, Dict, Any, List
-# from numpy.core.getlimits import MachArLike
-
-from requests import Request, Session, Response
-import hmac
-# from ciso8601 import parse_datetime
-
-
-class FtxClient:
-    _ENDPOINT = 'https://ftx.com/api/'
-
-    def __init__(self, api_key=None, api_secret=None, subaccount_name=None) -> None:
-        self._session = Session()
-        self._api_key = api_key
-        self._api_secret = api_secret
-        self._subaccount_name = subaccount_name
-
-    def _get(self, path: str, params: Optional[Dict[str, Any]] = None) -> Any:
-        return self._request('GET', path, params=params)
-
-    def _post(self, path: str, params: Optional[Dict[str, Any]] = None) -> Any:
-        return self._request('POST', path, json=params)
-
-    def _delete(self, path: str, params: Optional[Dict[str, Any]] = None) -> Any:
-        return self._request('DELETE', path, json=params)
-
-    def _request(self, method: str, path: str, **kwargs) -> Any:
-        request = Request(method, self._ENDPOINT + path, **kwargs)
-        self._sign_request(request)
-        response = self._session.send(request.prepare())
-        return self._process_response(response)
-
-    def _sign_request(self, request: Request) -> None:
-        ts = int(time.time() * 1000)
-        prepared = request.prepare()
-        signature_payload = f'{ts}{prepared.method}{prepared.path_url}'.encode()
-        if prepared.body:
-            signature_payload += prepared.body
-        signature = hmac.new(self._api_secret.encode(), signature_payload, 'sha256').hexdigest()
-        request.headers['FTX-KEY'] = self._api_key
-        request.headers['FTX-SIGN'] = signature
-        request.headers['FTX-TS'] = str(ts)
-        if self._subaccount_name:
-            request.headers['FTX-SUBACCOUNT'] = urllib.parse.quote(self._subaccount_name)
-
-    def _process_response(self, response: Response) -> Any:
-        try:
-            data = response.json()
-        except ValueError:
-            response.raise_for_status()
-            raise
-        else:
-            if not data['success']:
-                raise Exception(data['error'])
-            return data['result']
-
-    def list_futures(self) -> List[dict]:
-        return self._get('futures')
-
-    def list_markets(self) -> List[dict]:
-        return self._get('markets')
-
-    def get_orderbook(self, market: str, depth: int = None) -> dict:
-        return self._get(f'markets/{market}/orderbook', {'depth': depth})
-
-    def get_trades(self, market: str) -> dict:
-        return self._get(f'markets/{market}/trades')
-
-    def get_account_info(self) -> dict:
-        return self._get(f'account')
-
-    def get_open_orders(self, market: str = None) -> List[dict]:
-        return self._get(f'orders', {'market': market})
-    
-    def get_order_history(self, market: str = None, side: str = None, order_type: str = None, start_time: float = None, end_time: float = None) -> List[dict]:
-        return self._get(f'orders/history', {'market': market, 'side': side, 'orderType': order_type, 'start_time': start_time, 'end_time': end_time})
-        
-    def get_conditional_order_history(self, market: str = None, side: str = None, type: str = None, order_type: str = None, start_time: float = None, end_time: float = None) -> List[dict]:
-        return self._get(f'conditional_orders/history', {'market': market, 'side': side, 'type': type, 'orderType': order_type, 'start_time': start_time, 'end_time': end_time})
-
-    def modify_order(
-        self, existing_order_id: Optional[str] = None,
-        existing_client_order_id: Optional[str] = None, price: Optional[float] = None,
-        size: Optional[float] = None, client_order_id: Optional[str] = None,
-    ) -> dict:
-        assert (existing_order_id is None) ^ (existing_client_order_id is None), \
-            'Must supply exactly one ID for the order to modify'
-        assert (price is None) or (size is None), 'Must modify price or size of order'
-        path = f'orders/{existing_order_id}/modify' if existing_order_id is not None else \
-            f'orders/by_client_id/{existing_client_order_id}/modify'
-        return self._post(path, {
-            **({'size': size} if size is not None else {}),
-            **({'price': price} if price is not None else {}),
-            ** ({'clientId': client_order_id} if client_order_id is not None else {}),
-        })
-
-    def get_conditional_orders(self, market: str = None) -> List[dict]:
-        return self._get(f'conditional_orders', {'market': market})
-
-    def place_order(self, market: str, side: str, price: float, size: float, type: str = 'limit',
-                    reduce_only: bool = False, ioc: bool = False, post_only: bool = False,
-                    client_id: str = None) -> dict:
-        return self._post('orders', {'market': market,
-                                     'side': side,
-                                     'price': price,
-                                     'size': size,
-                                     'type': type,
-                                     'reduceOnly': reduce_only,
-                                     'ioc': ioc,
-                                     'postOnly': post_only,
-                                     'clientId': client_id,
-                                     })
-
-    def place_conditional_order(
-        self, market: str, side: str, size: float, type: str = 'stop',
-        limit_price: float = None, reduce_only: bool = False, cancel: bool = True,
-        trigger_price: float = None, trail_value: float = None
-    ) -> dict:
-        """
-        To send a Stop Market order, set type='stop' and supply a trigger_price
-        To send a Stop Limit order, also supply a limit_price
-        To send a Take Profit Market order, set type='trailing_stop' and supply a trigger_price
-        To send a Trailing Stop order, set type='trailing_stop' and supply a trail_value
-        """
-        assert type in ('stop', 'take_profit', 'trailing_stop')
-        assert type not in ('stop', 'take_profit') or trigger_price is not None, \
-            'Need trigger prices for stop losses and take profits'
-        assert type not in ('trailing_stop',) or (trigger_price is None and trail_value is not None), \
-            'Trailing stops need a trail value and cannot take a trigger price'
-
-        return self._post('conditional_orders',
-                          {'market': market, 'side': side, 'triggerPrice': trigger_price,
-                           'size': size, 'reduceOnly': reduce_only, 'type': 'stop',
-                           'cancelLimitOnTrigger': cancel, 'orderPrice': limit_price})
-
-    def cancel_order(self, order_id: str) -> dict:
-        return self._delete(f'orders/{order_id}')
-
-    def cancel_orders(self, market_name: str = None, conditional_orders: bool = False,
-                      limit_orders: bool = False) -> dict:
-        return self._delete(f'orders', {'market': market_name,
-                                        'conditionalOrdersOnly': conditional_orders,
-                                        'limitOrdersOnly': limit_orders,
-                                        })
-
-    def get_fills(self) -> List[dict]:
-        return self._get(f'fills')
-
-    def get_balances(self) -> List[dict]:
-        return self._get('wallet/balances')
-
-    def get_deposit_address(self, ticker: str) -> dict:
-        return self._get(f'wallet/deposit_address/{ticker}')
-
-    def get_positions(self, show_avg_price: bool = False) -> List[dict]:
-        return self._get('positions', {'showAvgPrice': show_avg_price})
-
-    def get_position(self, name: str, show_avg_price: bool = False) -> dict:
-        return next(filter(lambda x: x['future'] == name, self.get_positions(show_avg_price)), None)
-
-    def get_all_trades(self, market: str, start_time: float = None, end_time: float = None, order= None) -> List:
-        ids = set()
-        limit = 100
-        results = []
-        while True:
-            response = self._get(f'markets/{market}/trades', {
-                'end_time': end_time,
-                'start_time': start_time,
-                'order': order
-            })
-            deduped_trades = [r for r in response if r['id'] not in ids]
-            results.extend(deduped_trades)
-            ids |= {r['id'] for r in deduped_trades}
-            print(f'Adding {len(response)} trades with end time {end_time}')
-            if len(response) == 0:
-                break
-            end_time = min(t['time'] for t in response)
-            if len(response) < limit:
-                break
-        return results
+from client import FtxClient
 
 
 #%% MOVE TO ANOTHER FILE AFTER FAMILIARIZING AND IMPORT
 #  using client class
+import importlib.util
+import numpy as np
 import pandas as pd
 import time
-from datetime import datetime
 import yaml
+try:
+  from yaml import CSafeLoader as _YamlLoader
+except ImportError:
+  from yaml import SafeLoader as _YamlLoader
 
 pd.set_option('display.max_columns',100)
 pd.set_option('precision', 3)
 pd.set_option('display.float_format', lambda x: '%.3f' % x)
 
-hist_rates = pd.DataFrame()
-hist_spot = pd.DataFrame()
-hist_perp = pd.DataFrame()
+l_rates, l_spot, l_perp = [], [], []
 
-with open ('api_config.yaml', 'r') as fl:
-  data_config = yaml.safe_load(fl)
-  # print(dt_load)
+# re-running the cell keeps the already parsed data_config
+if 'data_config' not in globals():
+  with open('api_config.yaml', 'rb') as fl:
+    data_config = yaml.load(fl, Loader=_YamlLoader)
 
 loaded_key = data_config['api_key']
 loaded_secret = data_config['api_secret']
 
-c = FtxClient(api_key=loaded_key, api_secret=loaded_secret)
+# cache historical pulls on disk when diskcache is installed
+cache_dir = '~/.ftx_cache' if importlib.util.find_spec('diskcache') is not None else None
+
+c = FtxClient(api_key=loaded_key, api_secret=loaded_secret, cache_dir=cache_dir)
+
+def _candles_to_df(rows):
+  n = len(rows)
+  d_cols = {'startTime': [r['startTime'] for r in rows]}
+  d_cols['time'] = np.fromiter((r['time'] for r in rows), 'int64', n)
+  for col in ('open', 'high', 'low', 'close', 'volume'):
+    d_cols[col] = np.fromiter((r[col] for r in rows), 'f8', n)
+  return pd.DataFrame(d_cols)
 
-epoch = datetime.utcfromtimestamp(0)
+def _rates_to_df(rows):
+  n = len(rows)
+  return pd.DataFrame({
+    'future': [r['future'] for r in rows],
+    'rate': np.fromiter((r['rate'] for r in rows), 'f8', n),
+    'time': [r['time'] for r in rows],
+  })
 
 l_markets = ['MKR', 'DOT', 'SRM', 'FTT', 'SOL', 'LUNA', 'BNB', 'LINK', 'ADA', 'NEAR', 'LTC','SUSHI', 'AXS']
 
 #%%
-i_month = 12
+first_month = '2021-12-01'
+last_month = '2021-12-01'
 last_day = 16
-dt = datetime(2021,i_month,1)
-print(f'period: {i_month}/21')
+# each window is [1st, last_day + 1) of its month, in unix seconds
+starts = pd.date_range(first_month, last_month, freq='MS').values.astype('datetime64[s]').astype('int64')
+ends = starts + last_day * 86400
 
-# market_i = l_markets[0]
-for market_i in l_markets:
-  market_perp = market_i + '-PERP'
-  market_spot = market_i + '/USD'
+for unix_start, unix_end in zip(starts.tolist(), ends.tolist()):
+  period = time.strftime('%m/%y', time.gmtime(unix_start))
+  print(f'period: {period}')
 
-  unix_start = (dt - epoch).total_seconds()
-  unix_end = (datetime(2021,i_month,last_day) - epoch).total_seconds() + 86400
+  # market_i = l_markets[0]
+  for market_i in l_markets:
+    market_perp = market_i + '-PERP'
+    market_spot = market_i + '/USD'
 
-  d_params = {
-    'start_time': unix_start,
-    'end_time': unix_end,
-    'future': market_perp,
-  }
+    d_params = {
+      'start_time': unix_start,
+      'end_time': unix_end,
+      'future': market_perp,
+    }
 
-  d_params_candle = {
-    'resolution': 3600,
-    'start_time': unix_start,
-    'end_time': unix_end,
-  }
+    d_params_candle = {
+      'resolution': 3600,
+      'start_time': unix_start,
+      'end_time': unix_end,
+    }
 
-  rates_perp = c._get('funding_rates', d_params)
+    rates_perp = c._get('funding_rates', d_params)
 
-  candle_perp = c._get(f'/markets/{market_perp}/candles', d_params_candle)
+    candle_perp = c._get(f'/markets/{market_perp}/candles', d_params_candle)
 
-  try:
-    candle_spot = c._get(f'/markets/{market_spot}/candles', d_params_candle)
-  except Exception:
-    print(f'No such spot market: {market_spot}')
-    market_spot = None
+    try:
+      candle_spot = c._get(f'/markets/{market_spot}/candles', d_params_candle)
+    except Exception:
+      print(f'No such spot market: {market_spot}')
+      market_spot = None
 
 
-  if rates_perp:
-    df_rates = pd.DataFrame.from_dict(rates_perp)
-    hist_rates = hist_rates.append(df_rates)
-    min_t = min(df_rates['time'])
-    max_t = max(df_rates['time'])
-    print(f'from: {min_t} to: {max_t}')
+    if rates_perp:
+      df_rates = _rates_to_df(rates_perp)
+      l_rates.append(df_rates)
+      min_t = min(df_rates['time'])
+      max_t = max(df_rates['time'])
+      print(f'from: {min_t} to: {max_t}')
 
-  if market_spot:
-    hist_spot = hist_spot.append(pd.DataFrame.from_dict(candle_spot))
-    hist_perp = hist_perp.append(pd.DataFrame.from_dict(candle_perp))
-    print(f'spot data since: {hist_spot.startTime.min()}')
-    print(f'perp data since: {hist_perp.startTime.min()}')
+    if market_spot:
+      df_spot = _candles_to_df(candle_spot)
+      df_perp = _candles_to_df(candle_perp)
+      l_spot.append(df_spot)
+      l_perp.append(df_perp)
+      print(f'spot data since: {df_spot.startTime.min()}')
+      print(f'perp data since: {df_perp.startTime.min()}')
 
-  print(f'month {i_month}/21 finished for market {market_i}')
+    print(f'month {period} finished for market {market_i}')
 
-# unix_start = unix_end
 
 #%% set indexes
+hist_rates = pd.concat(l_rates, copy=False)
+hist_spot = pd.concat(l_spot, copy=False)
+hist_perp = pd.concat(l_perp, copy=False)
 hist_rates.set_index('time', inplace=True)
 hist_spot.set_index('startTime', inplace=True)
 hist_perp.set_index('startTime', inplace=True)